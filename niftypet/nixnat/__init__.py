@@ -22,3 +22,21 @@ from .xnat.xnat import time_stamp
 
 from .xnat.xnat import getscan
 from .xnat.xnat import getresources
+
+from .xnat.shard import init_queue
+from .xnat.shard import queue_scans
+from .xnat.shard import work_queue
+from .xnat.shard import run_workers
+from .xnat.shard import queue_status
+
+from .xnat.pack import pack_series
+from .xnat.pack import unpack_series
+from .xnat.pack import packed_files
+from .xnat.pack import read_packed
+from .xnat.pack import open_pack
+
+from .xnat.meta import classify_scans
+from .xnat.meta import push_dcminfo
+from .xnat.meta import get_dcminfo
+
+from .xnat.tune import get_files
@@ -0,0 +1,217 @@
+""" NIXNAT: pushing the DICOM-derived classification of scans (`dcminfo`)
+    back to XNAT, so that it can be used later without downloading the scans.
+"""
+__author__    = "Pawel Markiewicz"
+__copyright__ = "Copyright 2019"
+#-------------------------------------------------------------------------------
+
+import json
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
+import pydicom as dcm
+
+from . import xnat
+from .xnat import get_logger, log_default
+from .pack import is_packed, read_packed, first_dicom
+
+
+#> experiment resource with the JSON sidecar
+meta_resource = 'NIXNAT'
+meta_file = 'dcminfo.json'
+
+#> number of concurrent requests for pushing the metadata
+nthrd_default = 4
+
+
+#> scan-level custom fields: field name -> key of the scan info
+meta_fields = {
+    'nixnat_category': 'category',
+    'nixnat_scanner_id': 'scanner_id',
+    'nixnat_tr': 'TR',
+    'nixnat_te': 'TE'}
+
+
+def _field_xpath(name):
+    ''' XNAT path of the scan-level custom field.
+    '''
+    return 'xnat:imageScanData/fields/field[name={}]/field'.format(name)
+
+
+# ------------------------------------------------------------------------------
+def classify_scans(out, verbose=False, Cnt=None):
+    ''' Classify the scans downloaded by `getscan` (its output dictionary)
+        using the header of the first DICOM file of every scan (scans without
+        DICOM files, e.g., NIFTI only, are skipped).
+        Returns a dictionary of scan ID -> {category, scanner_id, TR, TE}.
+    '''
+    info = {}
+    for s_type_id in out:
+        if s_type_id in ['cookie', 'nfiles'] or not out[s_type_id]:
+            continue
+
+        #> the first DICOM file, or DICOM member of a packed series
+        dhdr = None
+        for fpth in out[s_type_id]:
+            if is_packed(fpth):
+                idcm = first_dicom(fpth)
+                if idcm is not None:
+                    dhdr = read_packed(fpth, idcm)
+                    break
+            elif isinstance(fpth, str) and fpth.endswith(xnat.dcm_ext):
+                dhdr = dcm.dcmread(fpth, stop_before_pixels=True)
+                break
+        if dhdr is None:
+            continue
+
+        dinfo = xnat.dcminfo(dhdr, verbose=verbose, Cnt=Cnt)
+        info[s_type_id.split('_',1)[0]] = {
+            'category': dcminfo_category(dinfo),
+            'scanner_id': dinfo[-1] if dinfo[0]!='unknown' else 'unknown',
+            'TR': float(dhdr[0x18, 0x80].value) if [0x18, 0x80] in dhdr else 0,
+            'TE': float(dhdr[0x18, 0x81].value) if [0x18, 0x81] in dhdr else 0}
+
+    return info
+
+
+def dcminfo_category(dinfo):
+    ''' Category string (e.g., 'raw/list') of the `dcminfo` output, without
+        the scanner ID.
+    '''
+    if dinfo[0]=='unknown':
+        return 'unknown'
+    return '/'.join(dinfo[:-1])
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def _check(rcode, uri, ok=()):
+    ''' Raise IOError for a failed request.
+    '''
+    if rcode>=400 and rcode not in ok:
+        raise IOError('e> HTTP error {} for {}'.format(rcode, uri))
+
+
+def _push_fields(expuri, info, cookie):
+    ''' Write the classification as scan-level custom fields (one PUT per
+        scan, as XNAT has no update of many scans in one request).
+    '''
+    for sid in info:
+        qry = '&'.join(
+            _field_xpath(f)+'='+quote(str(info[sid][k])) for f, k in meta_fields.items())
+        uri = expuri+'/scans/'+sid+'?'+qry
+        _check(xnat.put_data(uri, cookie=cookie), uri)
+
+
+def _push_sidecar(expuri, info, cookie):
+    ''' Write the classification of all scans of the experiment as one JSON
+        sidecar in the experiment resource (a single upload).
+    '''
+    resuri = expuri+'/resources/'+meta_resource
+    #> the resource may exist already (409 conflict)
+    _check(xnat.put_data(resuri+'?format=json', cookie=cookie), resuri, ok=(409,))
+    return xnat.post_data(
+        resuri+'/files/'+meta_file+'?inbody=true&overwrite=true',
+        json.dumps(info), PUT=True, cookie=cookie, check=True)
+
+
+def push_dcminfo(
+        sbjexps,
+        xc,
+        cookie='',
+        mode='sidecar',
+        nthrd=nthrd_default,
+        wait=False,
+        Cnt=None):
+    ''' Push the `dcminfo` classification of scans back to XNAT in the
+        background.
+        sbjexps: dictionary of (subject, experiment ID) -> scan info (as
+                 returned by `classify_scans`).
+        mode:    'sidecar' (default) for one JSON file per experiment (all its
+                 scans in one request; the batched path), 'fields' for
+                 scan-level custom fields (nixnat_category, nixnat_scanner_id,
+                 nixnat_tr, nixnat_te) searchable in XNAT, at the cost of one
+                 request per scan, or 'both'.
+        Returns the list of futures (one per experiment), or their results
+        if <wait> is True.  Failed pushes raise IOError in the futures and
+        are logged as errors.
+    '''
+
+    #> check if the dictionary of constant is given
+    if Cnt is None:
+        Cnt = {}
+
+    #-------------------------------------------
+    #> set the logger and its level of verbose
+    log = get_logger(__name__)
+    log.setLevel(Cnt.get('LOG', log_default))
+    #-------------------------------------------
+
+    if not cookie:
+        cookie = xc['cookie']
+
+    if mode not in ['sidecar', 'fields', 'both']:
+        raise ValueError('e> unknown mode of pushing the metadata: {}'.format(mode))
+
+    def push(sbjix, expid, info):
+        expuri = xc['sbj']+'/' +sbjix+ '/experiments/' + expid
+        if mode in ['fields', 'both']:
+            _push_fields(expuri, info, cookie)
+        if mode in ['sidecar', 'both']:
+            _push_sidecar(expuri, info, cookie)
+        log.info('pushed classification of {} scans for {}.'.format(len(info), expid))
+        return expid
+
+    def report(fut):
+        if fut.exception() is not None:
+            log.error('pushing the classification failed: {}'.format(fut.exception()))
+
+    pool = ThreadPoolExecutor(max_workers=nthrd)
+    futs = [pool.submit(push, sbjix, expid, sbjexps[(sbjix, expid)]) for sbjix, expid in sbjexps]
+    for f in futs:
+        f.add_done_callback(report)
+    pool.shutdown(wait=False)
+
+    if wait:
+        return [f.result() for f in futs]
+    return futs
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def get_dcminfo(sbjix, expid, xc, cookie='', category=None):
+    ''' Get the classification of the scans stored in XNAT for the experiment,
+        from the JSON sidecar (or, if there is none, from the scan-level
+        custom fields in a single scan listing), without downloading any scan.
+        With <category> (e.g., 'raw/list' or 'mr'), only the matching scans
+        are returned.
+    '''
+    if not cookie:
+        cookie = xc['cookie']
+
+    expuri = xc['sbj']+'/' +sbjix+ '/experiments/' + expid
+
+    info = None
+    try:
+        info = xnat.get_data(
+            expuri+'/resources/'+meta_resource+'/files/'+meta_file,
+            cookie=cookie, usrpwd=xc.get('usrpwd', ''))
+    except ValueError:
+        pass
+
+    if not isinstance(info, dict):
+        scans = xnat.get_list(
+            expuri+'/scans?format=json&columns=ID,type,'
+                +','.join(_field_xpath(f) for f in meta_fields),
+            cookie=cookie)
+        info = {}
+        for s in scans:
+            sinfo = {k: s.get(_field_xpath(f)) for f, k in meta_fields.items()}
+            if sinfo['category']:
+                info[s['ID']] = sinfo
+
+    if category is not None:
+        info = {sid:info[sid] for sid in info if info[sid]['category'].startswith(category)}
+
+    return info
+# ------------------------------------------------------------------------------
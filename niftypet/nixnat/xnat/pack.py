@@ -0,0 +1,263 @@
+""" NIXNAT: packing of downloaded DICOM series into a single indexed container
+    (zip file) with the header elements shared by all slices stored once.
+"""
+__author__    = "Pawel Markiewicz"
+__copyright__ = "Copyright 2019"
+#-------------------------------------------------------------------------------
+
+import os
+import io
+import json
+import zlib
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pydicom as dcm
+from pydicom.errors import InvalidDicomError
+
+
+#> extension of the packed series
+pack_ext = '.nxz'
+
+#> members of the container
+mindex = 'index.json'
+mheader = 'header.dcm.z'
+
+#> size of the chunks [B] of files streamed in and out of the container
+chunk_size = 2**20
+
+
+# ------------------------------------------------------------------------------
+def _dcm_bytes(ds):
+    ''' Write a DICOM dataset into bytes.
+    '''
+    buff = io.BytesIO()
+    try:
+        dcm.dcmwrite(buff, ds, enforce_file_format=True)
+    except TypeError:
+        #> pydicom < 3.0
+        dcm.dcmwrite(buff, ds, write_like_original=False)
+    return buff.getvalue()
+
+
+def _read_header(fpth):
+    ''' Read the DICOM header (without pixel data); None if not DICOM.
+    '''
+    try:
+        return dcm.dcmread(fpth, stop_before_pixels=True)
+    except InvalidDicomError:
+        return None
+
+
+def _write_stream(zf, member, fpth, level):
+    ''' Compress the file into the container member chunk by chunk.
+    '''
+    cmp = zlib.compressobj(level)
+    with open(fpth, 'rb') as fb, zf.open(member, 'w', force_zip64=True) as fz:
+        for data in iter(lambda: fb.read(chunk_size), b''):
+            fz.write(cmp.compress(data))
+        fz.write(cmp.flush())
+
+
+def _read_stream(zf, member, fout):
+    ''' Decompress the container member into the file chunk by chunk.
+    '''
+    dcmp = zlib.decompressobj()
+    with zf.open(member, 'r') as fz, open(fout, 'wb') as fb:
+        for data in iter(lambda: fz.read(chunk_size), b''):
+            fb.write(dcmp.decompress(data))
+        fb.write(dcmp.flush())
+
+
+def _shared_header(fpths):
+    ''' Get the dataset of the elements (other than pixel data) which are the
+        same in all the DICOM files, reading one header at a time.
+        Returns the shared dataset (None if there are less than two DICOM
+        files) and the list of flags for the files being DICOM.
+    '''
+    shrd = None
+    isdcm = []
+    ndcm = 0
+    for fpth in fpths:
+        hdr = _read_header(fpth)
+        isdcm.append(hdr is not None)
+        if hdr is None:
+            continue
+        ndcm += 1
+        if shrd is None:
+            shrd = dcm.Dataset()
+            shrd.file_meta = hdr.file_meta
+            for elem in hdr:
+                shrd.add(elem)
+        else:
+            for tag in list(shrd.keys()):
+                if tag not in hdr or hdr[tag]!=shrd[tag]:
+                    del shrd[tag]
+    if ndcm<2:
+        shrd = None
+    return shrd, isdcm
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def pack_series(spth, fpack=None, fnms=None, dedup=True, level=6, nthrd=None, remove=False):
+    ''' Pack the files of the series in folder <spth> (all of them or the
+        list of names <fnms>) into one container <fpack> (by default <spth>
+        with extension '.nxz').  The container is a zip file with an index
+        and every file compressed separately, allowing random access by
+        index.  DICOM files stripped of the shared header are compressed in
+        parallel, a few files in memory at a time; other files (e.g., large
+        raw data) are streamed from disk.  With <dedup>,
+        the DICOM header elements shared by all slices are stored only once;
+        the DICOM files are then re-encoded, so that unpacked files have the
+        same elements but not the same bytes as the originals.
+        With <remove>, the packed files (and the folder, if left empty) are
+        deleted after packing.
+        Returns the path to the container.
+    '''
+
+    if fpack is None:
+        fpack = spth.rstrip(os.sep)+pack_ext
+
+    #> all files of the series (hidden files, e.g. digest records, skipped)
+    if fnms is None:
+        fnms = [
+            f for f in os.listdir(spth)
+            if os.path.isfile(os.path.join(spth, f)) and not f.startswith('.')]
+    fnms = sorted(fnms)
+    fpths = [os.path.join(spth, f) for f in fnms]
+
+    if dedup:
+        shrd, isdcm = _shared_header(fpths)
+    else:
+        shrd, isdcm = None, [_read_header(f) is not None for f in fpths]
+
+    #> files re-encoded without the shared elements
+    strip = [d and shrd is not None for d in isdcm]
+
+    def compress(i):
+        ds = dcm.dcmread(fpths[i])
+        for tag in shrd.keys():
+            del ds[tag]
+        return zlib.compress(_dcm_bytes(ds), level)
+
+    index = [{
+        'name': f,
+        'member': 'data/{:06d}.z'.format(i),
+        'kind': 'dcm' if isdcm[i] else 'raw'} for i, f in enumerate(fnms)]
+
+    nthrd = nthrd or os.cpu_count()
+    with zipfile.ZipFile(fpack, 'w', compression=zipfile.ZIP_STORED) as zf, \
+            ThreadPoolExecutor(max_workers=nthrd) as pool:
+
+        zf.writestr(mindex, json.dumps({'shared': shrd is not None, 'files': index}))
+        if shrd is not None:
+            zf.writestr(mheader, zlib.compress(_dcm_bytes(shrd), level))
+
+        #> compress in parallel (zlib releases the GIL), with a bounded number
+        #> of files in flight, writing them in order as they are done
+        futs = {}
+        for i in range(len(fnms)+2*nthrd):
+            if i<len(fnms) and strip[i]:
+                futs[i] = pool.submit(compress, i)
+            j = i-2*nthrd
+            if j>=0 and strip[j]:
+                zf.writestr(index[j]['member'], futs.pop(j).result())
+            elif j>=0:
+                _write_stream(zf, index[j]['member'], fpths[j], level)
+
+    if remove:
+        for fpth in fpths:
+            os.remove(fpth)
+        if not [f for f in os.listdir(spth) if not f.startswith('.')]:
+            shutil.rmtree(spth)
+
+    return fpack
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def is_packed(fpth):
+    ''' Check if the path is a packed series.
+    '''
+    return isinstance(fpth, str) and fpth.endswith(pack_ext) and zipfile.is_zipfile(fpth)
+
+
+def open_pack(fpack):
+    ''' Open the container for reading multiple files; the returned zip file
+        can be passed to `packed_files` and `read_packed` instead of the path.
+    '''
+    return zipfile.ZipFile(fpack, 'r')
+
+
+def packed_files(fpack):
+    ''' Get the index of the packed series (list of dictionaries with the
+        original file name and kind).
+    '''
+    zf = fpack if isinstance(fpack, zipfile.ZipFile) else open_pack(fpack)
+    index = json.loads(zf.read(mindex))['files']
+    if zf is not fpack:
+        zf.close()
+    return index
+
+
+def first_dicom(fpack):
+    ''' Get the index of the first DICOM file in the packed series (None if
+        there is none).
+    '''
+    for i, itm in enumerate(packed_files(fpack)):
+        if itm['kind']=='dcm':
+            return i
+    return None
+
+
+def read_packed(fpack, idx, raw=False):
+    ''' Read file <idx> (index or original file name) from the packed series
+        without unpacking to disk.  DICOM files are returned as pydicom
+        datasets with the shared header merged back in, unless <raw> is True,
+        in which case the bytes of the file are returned.
+    '''
+    zf = fpack if isinstance(fpack, zipfile.ZipFile) else open_pack(fpack)
+
+    pidx = json.loads(zf.read(mindex))
+    if isinstance(idx, str):
+        idx = [f['name'] for f in pidx['files']].index(idx)
+    itm = pidx['files'][idx]
+
+    data = zlib.decompress(zf.read(itm['member']))
+
+    if itm['kind']=='dcm':
+        ds = dcm.dcmread(io.BytesIO(data))
+        if pidx['shared']:
+            shrd = dcm.dcmread(io.BytesIO(zlib.decompress(zf.read(mheader))))
+            for elem in shrd:
+                ds.add(elem)
+            if raw:
+                data = _dcm_bytes(ds)
+        if not raw:
+            data = ds
+
+    if zf is not fpack:
+        zf.close()
+    return data
+
+
+def unpack_series(fpack, outpath):
+    ''' Unpack all files of the packed series into folder <outpath>.  DICOM
+        files packed with the shared header are re-encoded (see `pack_series`);
+        other files are streamed to disk.
+    '''
+    os.makedirs(outpath, exist_ok=True)
+    out = []
+    with open_pack(fpack) as zf:
+        for i, itm in enumerate(packed_files(zf)):
+            fout = os.path.join(outpath, itm['name'])
+            if itm['kind']=='dcm':
+                with open(fout, 'wb') as fb:
+                    fb.write(read_packed(zf, i, raw=True))
+            else:
+                _read_stream(zf, itm['member'], fout)
+            out.append(fout)
+    return out
+# ------------------------------------------------------------------------------
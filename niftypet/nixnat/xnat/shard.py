@@ -0,0 +1,359 @@
+""" NIXNAT: sharing the download of a project between many workers (nodes),
+    using a work queue in an SQLite database on a shared file system.
+"""
+__author__    = "Pawel Markiewicz"
+__copyright__ = "Copyright 2019"
+#-------------------------------------------------------------------------------
+
+import os
+import json
+import time
+import uuid
+import shutil
+import socket
+import sqlite3
+import threading
+import multiprocessing
+
+from . import xnat
+from .xnat import get_logger, log_default, create_dir
+from .pack import is_packed, packed_files
+
+
+#> states of work items in the queue
+TODO = 'todo'
+HELD = 'held'
+DONE = 'done'
+FAILED = 'failed'
+
+#> default lease [s] for which a claimed work item is held by a worker
+lease_default = 600
+
+#> default number of attempts at a work item before it is marked as failed
+attempts_default = 3
+
+#> folder (inside the output path) for the partial downloads of workers
+part_dir = '.nixnat-part'
+
+
+# ------------------------------------------------------------------------------
+def _connect(fdb):
+    ''' Open the queue database; waits for the lock held by other workers.
+    '''
+    con = sqlite3.connect(fdb, timeout=120, isolation_level=None)
+    #> rollback journal works on network/parallel file systems (WAL does not)
+    con.execute('PRAGMA journal_mode=DELETE')
+    return con
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def init_queue(fdb, items):
+    ''' Create the work queue <fdb> (SQLite file on the shared file system)
+        and add the work items to it.  Each item is a dictionary with:
+            'sbjix': XNAT subject,
+            'expt':  experiment ID,
+            'scan':  scan ID (optional; all scans of the experiment if missing).
+        Items already in the queue are not added again.
+    '''
+    con = _connect(fdb)
+    con.execute(
+        '''CREATE TABLE IF NOT EXISTS work (
+            key TEXT PRIMARY KEY,
+            item TEXT,
+            state TEXT,
+            owner TEXT,
+            token TEXT,
+            lease_until REAL,
+            attempts INTEGER)''')
+
+    con.execute('BEGIN IMMEDIATE')
+    for itm in items:
+        key = '/'.join([itm['sbjix'], itm['expt'], str(itm.get('scan', ''))])
+        con.execute(
+            'INSERT OR IGNORE INTO work VALUES (?, ?, ?, NULL, NULL, 0, 0)',
+            (key, json.dumps(itm), TODO))
+    con.execute('COMMIT')
+    con.close()
+
+
+def queue_scans(fdb, xc, sbjexps, cookie=''):
+    ''' Create the work queue with one item per scan for the list of
+        (subject, experiment ID) pairs in <sbjexps>.
+    '''
+    if not cookie:
+        cookie = xc['cookie']
+
+    items = []
+    for sbjix, expt in sbjexps:
+        scans = xnat.get_list(
+            xc['sbj']+'/' +sbjix+ '/experiments/' + expt + '/scans',
+            cookie=cookie)
+        items.extend([{'sbjix':sbjix, 'expt':expt, 'scan':s['ID']} for s in scans])
+
+    init_queue(fdb, items)
+    return items
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def claim_work(fdb, worker, lease=lease_default, max_attempts=attempts_default):
+    ''' Claim the next work item which is not done and not held by another
+        worker (items with an expired lease of a crashed worker are claimed
+        again).  Items already attempted <max_attempts> times are marked as
+        failed instead.  Returns (key, item, token) or None when no work is left.
+    '''
+    con = _connect(fdb)
+    con.execute('BEGIN IMMEDIATE')
+    now = time.time()
+    con.execute(
+        '''UPDATE work SET state=?, lease_until=0
+            WHERE (state=? OR (state=? AND lease_until<?)) AND attempts>=?''',
+        (FAILED, TODO, HELD, now, max_attempts))
+    row = con.execute(
+        '''SELECT key, item FROM work
+            WHERE state=? OR (state=? AND lease_until<?)
+            ORDER BY attempts, key LIMIT 1''', (TODO, HELD, now)).fetchone()
+
+    if row is None:
+        con.execute('COMMIT')
+        con.close()
+        return None
+
+    token = uuid.uuid4().hex
+    con.execute(
+        '''UPDATE work SET state=?, owner=?, token=?, lease_until=?,
+            attempts=attempts+1 WHERE key=?''',
+        (HELD, worker, token, now+lease, row[0]))
+    con.execute('COMMIT')
+    con.close()
+    return row[0], json.loads(row[1]), token
+
+
+def renew_lease(fdb, key, token, lease=lease_default):
+    ''' Extend the lease of a held work item; returns False if the item is
+        no longer held with this token (the lease expired and was taken over).
+    '''
+    con = _connect(fdb)
+    cur = con.execute(
+        'UPDATE work SET lease_until=? WHERE key=? AND state=? AND token=?',
+        (time.time()+lease, key, HELD, token))
+    con.close()
+    return cur.rowcount==1
+
+
+def complete_work(fdb, key, token, commit_files=None):
+    ''' Mark the work item as done, if still held with <token>.  The function
+        <commit_files> is called while holding the database lock, so that the
+        downloaded files are moved into place by exactly one worker.
+        Returns True if the item was completed by this worker.
+    '''
+    con = _connect(fdb)
+    con.execute('BEGIN IMMEDIATE')
+    row = con.execute(
+        'SELECT state, token FROM work WHERE key=?', (key,)).fetchone()
+    if row is None or row[0]!=HELD or row[1]!=token:
+        con.execute('ROLLBACK')
+        con.close()
+        return False
+
+    try:
+        if commit_files is not None:
+            commit_files()
+    except Exception:
+        con.execute('ROLLBACK')
+        con.close()
+        raise
+
+    con.execute('UPDATE work SET state=?, lease_until=0 WHERE key=?', (DONE, key))
+    con.execute('COMMIT')
+    con.close()
+    return True
+
+
+def release_work(fdb, key, token):
+    ''' Return a held work item to the queue (e.g., after a failed download).
+    '''
+    con = _connect(fdb)
+    con.execute(
+        'UPDATE work SET state=?, lease_until=0 WHERE key=? AND state=? AND token=?',
+        (TODO, key, HELD, token))
+    con.close()
+
+
+def held_tokens(fdb):
+    ''' Get the tokens of the work items currently held by workers.
+    '''
+    con = _connect(fdb)
+    out = {r[0] for r in con.execute('SELECT token FROM work WHERE state=?', (HELD,))}
+    con.close()
+    return out
+
+
+def queue_status(fdb):
+    ''' Get the number of work items in each state.
+    '''
+    con = _connect(fdb)
+    out = dict(con.execute('SELECT state, COUNT(*) FROM work GROUP BY state').fetchall())
+    con.close()
+    return out
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def _move_files(ppth, opth):
+    ''' Move the downloaded scan folders from the partial path into the
+        output path (renames within the same file system).
+    '''
+    create_dir(opth)
+    for sdir in os.listdir(ppth):
+        #> packed series are single files
+        if os.path.isfile(os.path.join(ppth, sdir)):
+            os.replace(os.path.join(ppth, sdir), os.path.join(opth, sdir))
+            continue
+        create_dir(os.path.join(opth, sdir))
+        for fnm in os.listdir(os.path.join(ppth, sdir)):
+            os.replace(os.path.join(ppth, sdir, fnm), os.path.join(opth, sdir, fnm))
+    shutil.rmtree(ppth, ignore_errors=True)
+
+
+def _clean_parts(fdb, outpath):
+    ''' Remove the partial folders of work items no longer held with their
+        token (left behind by crashed workers or taken over), and the folder
+        of partial downloads when empty.
+    '''
+    pdir = os.path.join(outpath, part_dir)
+    if not os.path.isdir(pdir):
+        return
+    #> listed before getting the tokens: a folder is only created after its
+    #> item is claimed, so the token of a live folder is always found
+    parts = os.listdir(pdir)
+    held = held_tokens(fdb)
+    for token in parts:
+        if token not in held:
+            shutil.rmtree(os.path.join(pdir, token), ignore_errors=True)
+    try:
+        os.rmdir(pdir)
+    except OSError:
+        pass
+
+
+def _nfiles(fpths):
+    ''' Number of downloaded files, counting the files in packed series.
+    '''
+    return sum(len(packed_files(f)) if is_packed(f) else 1 for f in fpths)
+
+
+def work_queue(fdb, xc, outpath='', worker=None, lease=lease_default, Cnt=None, **kwargs):
+    ''' Download scans claimed from the work queue <fdb> until no work is left.
+        Many workers (on different nodes or local processes) can run this
+        function with the same queue and output path.  Each scan is downloaded
+        by `getscan` into a partial folder and moved into the common layout
+        <outpath>/<experiment>/<scan folder> only when the worker still holds
+        the lease, so every file is written into place exactly once.
+        Scans with missing files are returned to the queue, and items failing
+        more than Cnt['RETRY'] times (default 2) are marked as failed.
+        Partial folders of items no longer held (e.g., of crashed workers)
+        are removed.
+        Other keyword arguments are passed on to `getscan`.
+        Returns the list of completed work keys.
+    '''
+
+    #> check if the dictionary of constant is given
+    if Cnt is None:
+        Cnt = {}
+
+    #-------------------------------------------
+    #> set the logger and its level of verbose
+    log = get_logger(__name__)
+    log.setLevel(Cnt.get('LOG', log_default))
+    #-------------------------------------------
+
+    if worker is None:
+        worker = socket.gethostname()+'-'+str(os.getpid())
+
+    if outpath=='':
+        outpath = xc['opth']
+
+    _clean_parts(fdb, outpath)
+
+    done = []
+    while True:
+
+        claim = claim_work(
+            fdb, worker, lease=lease, max_attempts=Cnt.get('RETRY', 2)+1)
+        if claim is None:
+            break
+        key, itm, token = claim
+
+        log.info(f'worker {worker} claimed: {key}')
+
+        #> keep renewing the lease while the download is running
+        stop = threading.Event()
+        def renew():
+            while not stop.wait(lease/3.):
+                if not renew_lease(fdb, key, token, lease=lease):
+                    log.warning(f'worker {worker} lost the lease on: {key}')
+                    break
+        trnw = threading.Thread(target=renew, daemon=True)
+        trnw.start()
+
+        opth = os.path.join(outpath, itm['expt'])
+        ppth = os.path.join(outpath, part_dir, token)
+        create_dir(ppth)
+
+        try:
+            out = xnat.getscan(
+                itm['sbjix'],
+                itm['expt'],
+                xc,
+                scan_ids=[itm['scan']] if itm.get('scan') else [],
+                outpath=ppth,
+                Cnt=Cnt,
+                **kwargs)
+        except Exception as e:
+            stop.set()
+            log.error(f'worker {worker} failed on {key}: {e}')
+            release_work(fdb, key, token)
+            shutil.rmtree(ppth, ignore_errors=True)
+            continue
+        stop.set()
+
+        #> incomplete scans (failed transfers) are not moved into place
+        short = [
+            k for k, n in out['nfiles'].items() if _nfiles(out.get(k, []))!=n]
+        if short:
+            log.error(f'worker {worker}: incomplete download of {short} for {key}.')
+            release_work(fdb, key, token)
+            shutil.rmtree(ppth, ignore_errors=True)
+            continue
+
+        if complete_work(fdb, key, token, commit_files=lambda: _move_files(ppth, opth)):
+            done.append(key)
+            if 'cookie' not in xc:
+                xc['cookie'] = out['cookie']
+        else:
+            log.warning(f'worker {worker} discards {key} (taken over by another worker).')
+            shutil.rmtree(ppth, ignore_errors=True)
+
+    _clean_parts(fdb, outpath)
+
+    return done
+
+
+def run_workers(fdb, xc, nproc, outpath='', lease=lease_default, Cnt=None, **kwargs):
+    ''' Run <nproc> local processes working on the same queue, standing in
+        for the nodes of a cluster.
+    '''
+    prcs = [
+        multiprocessing.Process(
+            target=work_queue,
+            args=(fdb, xc),
+            kwargs=dict(outpath=outpath, worker='local-'+str(i), lease=lease, Cnt=Cnt, **kwargs))
+        for i in range(nproc)]
+    for p in prcs:
+        p.start()
+    for p in prcs:
+        p.join()
+    return queue_status(fdb)
+# ------------------------------------------------------------------------------
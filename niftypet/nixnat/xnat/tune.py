@@ -0,0 +1,227 @@
+""" NIXNAT: downloading many files in parallel, with the number of concurrent
+    transfers tuned at runtime (AIMD) from the observed throughput.
+"""
+__author__    = "Pawel Markiewicz"
+__copyright__ = "Copyright 2019"
+#-------------------------------------------------------------------------------
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+#> xnat imports get_files: its names are looked up at call time
+from . import xnat
+
+
+#> default concurrency: initial and maximum number of parallel transfers
+conc_init = 1
+conc_max = 16
+
+#> relative gain of throughput regarded as an improvement
+gain_min = 0.05
+
+#> the time to first byte growing above this multiple of the lowest seen
+#> (and above ttfb_min [s]) indicates a congested server
+ttfb_ratio = 3.
+ttfb_min = 0.05
+
+#> HTTP codes of an overloaded server (the transfer is repeated)
+busy_codes = (429, 502, 503, 504)
+
+#> delay [s] before the first repeat of a refused or failed transfer
+#> (doubled with every repeat), and the longest accepted Retry-After
+retry_delay = 0.5
+retry_max = 60.
+
+
+# ------------------------------------------------------------------------------
+def aimd_init(conc=conc_init, cmax=conc_max):
+    ''' State of the concurrency tuner.
+    '''
+    return {
+        'conc': conc,       # current number of parallel transfers
+        'cmax': cmax,       # upper limit
+        'best': 0.,         # best aggregate throughput [B/s] seen
+        'ttfb0': None,      # lowest mean time to first byte [s] seen
+        'probe': False,     # the last step was an increase
+        'hold': 0,          # windows left before probing again
+        'history': []}      # (concurrency, throughput, errors, ttfb) per window
+
+
+def aimd_step(state, nbytes, wtime, nerr, ttime=None, ttfb=None, hold=4):
+    ''' Update the concurrency from one measurement window with <nbytes>
+        transferred in <wtime> seconds and <nerr> failed transfers.  Given the
+        curl timing of the transfers, the aggregate throughput is estimated
+        as the per-transfer throughput (<nbytes> over the summed transfer
+        times <ttime>) times the concurrency, and the mean time to first byte
+        <ttfb> is compared with the lowest seen:
+        - errors: multiplicative decrease (halving);
+        - time to first byte growing (the server queues the requests):
+          decrease by one and hold for <hold> windows;
+        - throughput improving: additive increase by one;
+        - no improvement after an increase: step back and hold.
+        Returns the new concurrency.
+    '''
+    if ttime:
+        thrpt = nbytes/ttime*state['conc']
+    else:
+        thrpt = nbytes/wtime if wtime>0 else 0.
+    state['history'].append((state['conc'], thrpt, nerr, ttfb))
+
+    if ttfb is not None and (state['ttfb0'] is None or ttfb<state['ttfb0']):
+        state['ttfb0'] = ttfb
+
+    if nerr>0:
+        state['conc'] = max(1, state['conc']//2)
+        state['best'] = 0.
+        state['probe'] = False
+        state['hold'] = hold
+
+    elif ttfb is not None and ttfb>ttfb_min and ttfb>ttfb_ratio*state['ttfb0']:
+        state['conc'] = max(1, state['conc']-1)
+        state['best'] = thrpt
+        state['probe'] = False
+        state['hold'] = hold
+
+    elif thrpt>state['best']*(1+gain_min):
+        state['best'] = thrpt
+        if state['hold']>0:
+            state['hold'] -= 1
+            state['probe'] = False
+        elif state['conc']<state['cmax']:
+            state['conc'] += 1
+            state['probe'] = True
+
+    elif state['probe']:
+        #> the extra transfer did not help
+        state['conc'] = max(1, state['conc']-1)
+        state['probe'] = False
+        state['hold'] = hold
+
+    else:
+        #> keep the throughput up to date (e.g., when the network changes)
+        state['best'] = max(thrpt, 0.5*state['best'])
+        if state['hold']>0:
+            state['hold'] -= 1
+        elif state['conc']<state['cmax']:
+            state['conc'] += 1
+            state['probe'] = True
+
+    return state['conc']
+
+
+def retry_wait(stats, nretry):
+    ''' Delay [s] before repeating a transfer: the server's Retry-After (in
+        seconds, up to retry_max) or an exponential backoff.
+    '''
+    try:
+        return min(float(stats.get('retry_after')), retry_max)
+    except (TypeError, ValueError):
+        return retry_delay*2**nretry
+# ------------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+def get_files(jobs, cookie='', usrpwd='', Cnt=None, tune=None, dgsts=None):
+    ''' Download the files given as a list of (URI, file path, digest) in
+        parallel, using `get_file`.  The concurrency starts at Cnt['NCONC']
+        (default 1) and, unless Cnt['AUTOTUNE'] is False, is tuned with
+        `aimd_step` after every measurement window (completed transfers
+        equal to the current concurrency) up to Cnt['NCONC_MAX'] (default 16).
+        Transfers refused by an overloaded server, or failed on connection
+        errors, are repeated (Cnt['RETRY'] times, default 2) after the delay
+        given by `retry_wait`.
+        Returns the list of statuses of `get_file` (same order as <jobs>);
+        the tuner state is kept in dictionary <tune> if given (a non-empty
+        one continues from the previous call), and the verified digest
+        records in dictionary <dgsts> (see `get_file`).
+    '''
+
+    #> check if the dictionary of constant is given
+    if Cnt is None:
+        Cnt = {}
+
+    #-------------------------------------------
+    #> set the logger and its level of verbose
+    log = xnat.get_logger(__name__)
+    log.setLevel(Cnt.get('LOG', xnat.log_default))
+    #-------------------------------------------
+
+    state = aimd_init(
+        conc=Cnt.get('NCONC', conc_init),
+        cmax=Cnt.get('NCONC_MAX', conc_max))
+    if tune is not None:
+        if not tune:
+            tune.update(state)
+        state = tune
+    autotune = Cnt.get('AUTOTUNE', True)
+
+    status = [None]*len(jobs)
+    todo = list(range(len(jobs)))[::-1]
+    retry = [0]*len(jobs)
+
+    #> transfers to be repeated: (time when due, job index)
+    delayed = []
+
+    def transfer(i):
+        stats = {}
+        uri, fname, digest = jobs[i]
+        sts = xnat.get_file(
+            uri, fname, cookie=cookie, usrpwd=usrpwd, Cnt=Cnt, digest=digest, stats=stats,
+            dgsts=dgsts)
+        return i, sts, stats
+
+    #> measurement window: bytes, errors, transfers, start, summed transfer
+    #> times and times to first byte
+    wbytes, werr, wdone, wt0, wttime, wttfb = 0, 0, 0, time.time(), 0., []
+
+    running = set()
+    with ThreadPoolExecutor(max_workers=state['cmax']) as pool:
+        while todo or running or delayed:
+
+            #> repeats which are due
+            now = time.time()
+            todo.extend([i for t, i in delayed if t<=now])
+            delayed = [(t, i) for t, i in delayed if t>now]
+
+            while todo and len(running)<state['conc']:
+                running.add(pool.submit(transfer, todo.pop()))
+
+            tnext = min([t for t, i in delayed], default=None)
+            if not running:
+                time.sleep(max(0, tnext-time.time()))
+                continue
+
+            done, running = wait(
+                running,
+                timeout=None if tnext is None else max(0, tnext-time.time()),
+                return_when=FIRST_COMPLETED)
+
+            for fut in done:
+                i, sts, stats = fut.result()
+                status[i] = sts
+                wdone += 1
+                if sts<0:
+                    werr += 1
+                    if (stats.get('rcode') in busy_codes or 'error' in stats) \
+                            and retry[i]<Cnt.get('RETRY', 2):
+                        delay = retry_wait(stats, retry[i])
+                        log.info('repeating {} in {:.1f} s.'.format(jobs[i][0], delay))
+                        delayed.append((time.time()+delay, i))
+                        retry[i] += 1
+                else:
+                    wbytes += stats.get('size', 0)
+                    wttime += stats.get('time', 0)
+                    wttfb.append(stats.get('ttfb', 0))
+
+            if autotune and wdone>=state['conc']:
+                wtime = time.time()-wt0
+                conc = aimd_step(
+                    state, wbytes, wtime, werr,
+                    ttime=wttime,
+                    ttfb=sum(wttfb)/len(wttfb) if wttfb else None)
+                log.info('{:.2f} MB/s with {} errors: concurrency -> {}'.format(
+                    state['history'][-1][1]/1e6, werr, conc))
+                wbytes, werr, wdone, wt0, wttime, wttfb = 0, 0, 0, time.time(), 0., []
+
+    return status
+# ------------------------------------------------------------------------------
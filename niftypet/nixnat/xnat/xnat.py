@@ -16,10 +16,15 @@ import pydicom as dcm
 import pycurl
 import json
 import io
+import hashlib
+import threading
 from io import StringIO
 from datetime import datetime
 #--------------
 
+from .pack import is_packed, read_packed, first_dicom, pack_series, pack_ext
+from .tune import get_files
+
 #-------------------------------------------------------------------------------
 # LOGGING
 #-------------------------------------------------------------------------------
@@ -45,6 +50,11 @@ log_default = logging.WARNING
 # DICOM extensions
 dcm_ext = ('dcm', 'DCM', 'ima', 'IMA')
 
+#> file in each output folder keeping the verified digests of downloads
+fdigest = '.nixnat_digests.json'
+#> the digest records are updated by parallel downloads
+digest_lock = threading.Lock()
+
 
 # ------------------------------------------------------------------------------
 def create_dir(pth):
@@ -63,9 +73,82 @@ def time_stamp(simple_ascii=False):
 # ------------------------------------------------------------------------------
 
 
+# ------------------------------------------------------------------------------
+def read_digests(pth):
+    ''' Read the record of verified digests stored in folder <pth>.
+    '''
+    fdgst = os.path.join(pth, fdigest)
+    if not os.path.isfile(fdgst):
+        return {}
+    try:
+        with open(fdgst, 'r') as fj:
+            return json.load(fj)
+    except (IOError, ValueError):
+        return {}
+
+def digest_record(fpth, digest, hashtype='md5'):
+    ''' Record of the verified digest of file <fpth> together with its size
+        and modification time, so that it can be reused without re-reading it.
+    '''
+    return {
+        'hashtype': hashtype,
+        'digest': digest,
+        'size': os.path.getsize(fpth),
+        'mtime': os.path.getmtime(fpth)}
+
+def store_digests(recs):
+    ''' Store the digest records (dictionary of file path -> record), with
+        one atomic update of the record file per folder.
+    '''
+    fldrs = {}
+    for fpth in recs:
+        pth, fnm = os.path.split(os.path.abspath(fpth))
+        fldrs.setdefault(pth, {})[fnm] = recs[fpth]
+
+    for pth in fldrs:
+        with digest_lock:
+            dgsts = read_digests(pth)
+            dgsts.update(fldrs[pth])
+            ftmp = os.path.join(pth, fdigest+'.'+str(os.getpid())+'.tmp')
+            with open(ftmp, 'w') as fj:
+                json.dump(dgsts, fj)
+            os.replace(ftmp, os.path.join(pth, fdigest))
+
+def store_digest(fpth, digest, hashtype='md5'):
+    ''' Store the verified digest of a single file <fpth>.
+    '''
+    store_digests({fpth: digest_record(fpth, digest, hashtype=hashtype)})
+
+def file_digest(fpth, hashtype='md5'):
+    ''' Compute the digest of file <fpth> (read in chunks).
+    '''
+    hsh = hashlib.new(hashtype)
+    with open(fpth, 'rb') as fb:
+        for chunk in iter(lambda: fb.read(1<<20), b''):
+            hsh.update(chunk)
+    return hsh.hexdigest()
+
+def cached_digest(fpth, hashtype='md5'):
+    ''' Get the stored digest of file <fpth>; returns None if there is no
+        record or the file has changed since it was verified.
+    '''
+    if not os.path.isfile(fpth):
+        return None
+    pth, fnm = os.path.split(os.path.abspath(fpth))
+    rec = read_digests(pth).get(fnm)
+    if rec is None or rec['hashtype']!=hashtype \
+            or rec['size']!=os.path.getsize(fpth) \
+            or rec['mtime']!=os.path.getmtime(fpth):
+        return None
+    return rec['digest']
+# ------------------------------------------------------------------------------
+
+
 # ------------------------------------------------------------------------------
 def dcminfo(dcmvar, verbose=False, Cnt=None):
-    ''' Get basic info about the DICOM file/header.
+    ''' Get basic info about the DICOM file/header.  <dcmvar> can also be a
+        packed series (its first DICOM file is used) or a tuple of the packed
+        series and the file index/name.
     '''
 
     #> check if the dictionary of constant is given
@@ -85,16 +168,25 @@ def dcminfo(dcmvar, verbose=False, Cnt=None):
     #-------------------------------------------
 
 
-    if isinstance(dcmvar, str):
-        log.info('provided DICOM file:', dcmvar)
+    if is_packed(dcmvar):
+        log.info('provided packed DICOM series: {}'.format(dcmvar))
+        idcm = first_dicom(dcmvar)
+        if idcm is None:
+            raise ValueError('e> no DICOM file in the packed series: {}'.format(dcmvar))
+        dhdr = read_packed(dcmvar, idcm)
+    elif isinstance(dcmvar, tuple):
+        #> (packed series, file index or name)
+        dhdr = read_packed(*dcmvar)
+    elif isinstance(dcmvar, str):
+        log.info('provided DICOM file: {}'.format(dcmvar))
         dhdr = dcm.dcmread(dcmvar)
-    elif isinstance(dcmvar, dict):
-        dhdr = dcmvar
-    elif isinstance(dcmvar, dcm.dataset.FileDataset):
+    elif isinstance(dcmvar, (dict, dcm.dataset.Dataset)):
         dhdr = dcmvar
+    else:
+        raise TypeError('e> unrecognised DICOM input: {}'.format(type(dcmvar)))
 
     dtype   = dhdr[0x08, 0x08].value
-    log.info('Image Type:', dtype)
+    log.info('Image Type: {}'.format(dtype))
 
     #-------------------------------------------
     #> scanner ID
@@ -215,7 +307,17 @@ def get_data(xnaturi, frmt='json', cookie='', usrpwd=''):
         output = json.loads( buff.getvalue() )
     return output
 
-def get_file(xnaturi, fname, cookie='', usrpwd='', Cnt=None):
+def get_file(xnaturi, fname, cookie='', usrpwd='', Cnt=None, digest=None, hashtype='md5', stats=None, dgsts=None):
+    ''' Download file from <xnaturi> to <fname>.  The digest of the data is
+        computed while the file is being written and, if <digest> (e.g., the
+        XNAT `digest` column) is given, compared with it.  On mismatch the
+        download is repeated (Cnt['RETRY'] times, default 2).
+        If dictionary <stats> is given, it gets the curl timing of the last
+        transfer (size [B], total time and time to first byte [s], HTTP code,
+        Retry-After header), or the curl error code if the transfer failed.
+        If dictionary <dgsts> is given, the verified digest record is put in
+        it (to be stored with `store_digests`) instead of being stored at once.
+    '''
 
     #> check if the dictionary of constant is given
     if Cnt is None:
@@ -227,48 +329,99 @@ def get_file(xnaturi, fname, cookie='', usrpwd='', Cnt=None):
     log.setLevel(Cnt.get('LOG', log_default))
     #-------------------------------------------
 
-    try:
-        fn = open(fname, 'wb')
-        c = pycurl.Curl()
-        if cookie:
-            c.setopt(pycurl.COOKIE, cookie)
-        else:
-            c.setopt(c.USERPWD, usrpwd)
-        c.setopt(pycurl.SSL_VERIFYPEER, 0)
-        c.setopt(pycurl.SSL_VERIFYHOST, 0)
-        c.setopt(c.VERBOSE, 0)
-        c.setopt(c.URL, xnaturi )
-        c.setopt(c.WRITEDATA, fn)
-        c.setopt(pycurl.FOLLOWLOCATION, 0)
-        c.setopt(pycurl.NOPROGRESS, 0)
-        c.perform()
-        c.close()
-        fn.close()
-    except pycurl.error as pe:
-        a = f'''
-        ==============================================================
-        e> pycurl error: {pe}
-        ==============================================================
+    for attempt in range(Cnt.get('RETRY', 2)+1):
 
-        w> no data.
+        hsh = hashlib.new(hashtype)
 
-        '''
-        log.error(a)
-        return -1
+        try:
+            fn = open(fname, 'wb')
+
+            def write_chunk(chunk):
+                fn.write(chunk)
+                hsh.update(chunk)
+
+            #> the server may ask to retry later (e.g., with 429/503)
+            hdrs = {}
+            def read_header(line):
+                line = line.decode('iso-8859-1')
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    hdrs[name.strip().lower()] = value.strip()
+
+            c = pycurl.Curl()
+            if cookie:
+                c.setopt(pycurl.COOKIE, cookie)
+            else:
+                c.setopt(c.USERPWD, usrpwd)
+            c.setopt(pycurl.SSL_VERIFYPEER, 0)
+            c.setopt(pycurl.SSL_VERIFYHOST, 0)
+            c.setopt(c.VERBOSE, 0)
+            c.setopt(c.URL, xnaturi )
+            c.setopt(c.WRITEFUNCTION, write_chunk)
+            c.setopt(c.HEADERFUNCTION, read_header)
+            c.setopt(pycurl.FOLLOWLOCATION, 0)
+            c.setopt(pycurl.NOPROGRESS, 0)
+            c.perform()
+            rcode = c.getinfo(pycurl.RESPONSE_CODE)
+            if stats is not None:
+                stats['size'] = c.getinfo(getattr(pycurl, 'SIZE_DOWNLOAD_T', pycurl.SIZE_DOWNLOAD))
+                stats['time'] = c.getinfo(pycurl.TOTAL_TIME)
+                stats['ttfb'] = c.getinfo(pycurl.STARTTRANSFER_TIME)
+                stats['rcode'] = rcode
+                stats['retry_after'] = hdrs.get('retry-after')
+            c.close()
+            fn.close()
+        except pycurl.error as pe:
+            fn.close()
+            #> no truncated files left behind
+            os.remove(fname)
+            if stats is not None:
+                stats['error'] = pe.args[0]
+            a = f'''
+            ==============================================================
+            e> pycurl error: {pe}
+            ==============================================================
+
+            w> no data.
+
+            '''
+            log.error(a)
+            return -1
+
+        #> the server error pages are not data
+        if rcode>=400:
+            log.error(f'HTTP error {rcode} for {xnaturi}: no data.')
+            os.remove(fname)
+            return -1
+
+        fdgst = hsh.hexdigest()
+        if digest and fdgst!=digest:
+            log.warning(
+                f'{hashtype} digest mismatch for {fname}'
+                f' (attempt {attempt+1}): {fdgst} != {digest}')
+            continue
+
+        if digest and dgsts is not None:
+            dgsts[fname] = digest_record(fname, fdgst, hashtype=hashtype)
+        elif digest:
+            store_digest(fname, fdgst, hashtype=hashtype)
 
-    else:
         a = f'''
-        \rpycurl download done.
+        \rpycurl download done ({hashtype}: {fdgst}).
         \r---------------------
         '''
         log.info(a)
-    return 0
+        return 0
+
+    log.error(f'could not download {xnaturi} with a matching digest.')
+    os.remove(fname)
+    return -1
 #----------------------------------------------------------------------------------------------------------
 
 
 #----------------------------------------------------------------------------------------------------------
 def put_data(xnaturi, cookie='', usrpwd=''):
-    """e.g., create a container"""
+    """e.g., create a container; returns the HTTP response code"""
     c = pycurl.Curl()
     if cookie:
         c.setopt(pycurl.COOKIE, cookie)
@@ -282,7 +435,9 @@ def put_data(xnaturi, cookie='', usrpwd=''):
     c.setopt(c.URL, xnaturi )
     c.setopt(c.CUSTOMREQUEST, 'PUT')
     c.perform()
+    rcode = c.getinfo(pycurl.RESPONSE_CODE)
     c.close()
+    return rcode
 
 def del_data(xnaturi, cookie='', usrpwd=''):
     """e.g., create a container"""
@@ -301,7 +456,8 @@ def del_data(xnaturi, cookie='', usrpwd=''):
     c.perform()
     c.close()
 
-def post_data(xnaturi, post_data, verbose=0, PUT=False,  cookie='', usrpwd=''):
+def post_data(xnaturi, post_data, verbose=0, PUT=False,  cookie='', usrpwd='', check=False):
+    """post (or put) data; with <check>, raises IOError on HTTP errors"""
     buff = io.BytesIO()
     c = pycurl.Curl()
     if cookie:
@@ -319,26 +475,102 @@ def post_data(xnaturi, post_data, verbose=0, PUT=False,  cookie='', usrpwd=''):
     c.setopt(c.POSTFIELDS, post_data)
     c.setopt(c.WRITEFUNCTION, buff.write)
     c.perform()
+    rcode = c.getinfo(pycurl.RESPONSE_CODE)
     c.close()
+    if check and rcode>=400:
+        raise IOError('e> HTTP error {} for {}: {}'.format(
+            rcode, xnaturi, buff.getvalue().decode('UTF-8')))
     return buff.getvalue().decode('UTF-8')
 
-def put_file(xnaturi, filepath, cookie='', usrpwd=''):
-    """upload file to xnat server"""
-    c = pycurl.Curl()
-    if cookie:
-        c.setopt(pycurl.COOKIE, cookie)
-    elif usrpwd:
-        c.setopt(c.USERPWD, usrpwd)
-    else:
+def put_file(xnaturi, filepath, cookie='', usrpwd='', verify=False, hashtype='md5', Cnt=None):
+    ''' Upload file to xnat server.  The file is streamed in the request body
+        and its digest is computed while it is being read.  If <verify> is True,
+        the digest is compared with the one reported by XNAT for the uploaded
+        file and the upload is repeated on mismatch (Cnt['RETRY'] times).
+        If XNAT reports no digest, the upload cannot be verified (a warning is
+        logged).  Raises IOError on HTTP errors.
+        Returns the hex digest of the uploaded file.
+    '''
+
+    #> check if the dictionary of constant is given
+    if Cnt is None:
+        Cnt = {}
+
+    #-------------------------------------------
+    #> set the logger and its level of verbose
+    log = get_logger(__name__)
+    log.setLevel(Cnt.get('LOG', log_default))
+    #-------------------------------------------
+
+    if not cookie and not usrpwd:
         raise NameError('Session ID or username:password are not given')
-    c.setopt(pycurl.SSL_VERIFYPEER, 0)
-    c.setopt(pycurl.SSL_VERIFYHOST, 0)
-    c.setopt(pycurl.NOPROGRESS, 0)
-    c.setopt(c.VERBOSE, 0)
-    c.setopt(c.URL, xnaturi )
-    c.setopt(c.HTTPPOST, [('fileupload', (c.FORM_FILE, filepath,)),])
-    c.perform()
-    c.close()
+
+    #> XNAT reports MD5 digests
+    if verify and hashtype!='md5':
+        raise ValueError('e> only MD5 digests can be verified with XNAT.')
+
+    #> the file URI (the resource's `files` folder gets the file name)
+    fnm = os.path.basename(filepath)
+    furi = xnaturi.split('?',1)[0].rstrip('/')
+    if furi.endswith('/files'):
+        furi += '/'+fnm
+    qry = xnaturi.split('?',1)[1]+'&' if '?' in xnaturi else ''
+
+    for attempt in range(Cnt.get('RETRY', 2)+1):
+
+        hsh = hashlib.new(hashtype)
+
+        with open(filepath, 'rb') as fp:
+
+            def read_chunk(size):
+                chunk = fp.read(size)
+                hsh.update(chunk)
+                return chunk
+
+            c = pycurl.Curl()
+            if cookie:
+                c.setopt(pycurl.COOKIE, cookie)
+            else:
+                c.setopt(c.USERPWD, usrpwd)
+            c.setopt(pycurl.SSL_VERIFYPEER, 0)
+            c.setopt(pycurl.SSL_VERIFYHOST, 0)
+            c.setopt(pycurl.NOPROGRESS, 0)
+            c.setopt(c.VERBOSE, 0)
+            #> repeated uploads replace the file uploaded before
+            c.setopt(c.URL, furi+'?'+qry+'inbody=true'+('&overwrite=true' if attempt>0 else ''))
+            c.setopt(c.UPLOAD, 1)
+            c.setopt(c.READFUNCTION, read_chunk)
+            c.setopt(c.INFILESIZE_LARGE, os.path.getsize(filepath))
+            c.perform()
+            rcode = c.getinfo(pycurl.RESPONSE_CODE)
+            c.close()
+
+        if rcode>=400:
+            raise IOError(f'e> HTTP error {rcode} uploading {filepath}.')
+
+        fdgst = hsh.hexdigest()
+        if not verify:
+            return fdgst
+
+        files = get_list(
+            furi.rsplit('/',1)[0]+'?format=json',
+            cookie=cookie, usrpwd=usrpwd)
+        xdgst = [f.get('digest') for f in files if f['Name']==fnm]
+
+        #> no digest reported by XNAT (e.g., checksums disabled): not verifiable
+        if not xdgst or not xdgst[0]:
+            log.warning(f'no digest reported by XNAT for {fnm}: upload not verified.')
+            return fdgst
+
+        if xdgst[0]==fdgst:
+            log.info(f'verified upload of {fnm} ({hashtype}: {fdgst}).')
+            return fdgst
+
+        log.warning(
+            f'{hashtype} digest mismatch for the uploaded {fnm}'
+            f' (attempt {attempt+1}): {xdgst} != {fdgst}')
+
+    raise IOError(f'e> could not upload {filepath} with a matching digest.')
 #----------------------------------------------------------------------------------------------------------
 
 
@@ -374,11 +606,18 @@ def getscan(
         Cnt=None,
         info_only=False,
         output_quality=True,
+        packed=False,
         #close_session=True,
         ):
 
     '''
         expt:  XNAT experiment as a dictionary or string (ID or label)
+        packed: pack each downloaded series into a single container per
+                format (see `pack.pack_series`); the output then lists the
+                containers.
+        For each scan, the output lists the files of all requested formats.
+        The output dictionary also has the number of files listed in XNAT
+        for each scan under 'nfiles'.
     '''
 
     #> check if the dictionary of constant is given
@@ -424,6 +663,7 @@ def getscan(
     #> output dictionary
     out = {}
     out['cookie'] = cookie
+    out['nfiles'] = {}
 
     if outpath=='':
         if 'opth' in xc and os.path.isdir(xc['opth']):
@@ -447,6 +687,9 @@ def getscan(
 
     all_scan_types = [(s['type'],s['quality'],s['ID']) for s in scans]
 
+    #> state of the concurrency tuner shared by the downloads of all scans
+    tune = {}
+
     # import pdb; pdb.set_trace()
 
     picked_scans = []
@@ -485,13 +728,14 @@ def getscan(
 
             if e['format'] in dformat:
 
-                out[s_type_id] = []
+                out.setdefault(s_type_id, [])
 
                 files = get_list(
                         xc['sbj']+'/' +sbjix+ '/experiments/' + expid \
                             + '/scans/'+sid+'/resources/'+ e['format']+ '/files',
                         cookie=cookie
                         )
+                out['nfiles'][s_type_id] = out['nfiles'].get(s_type_id, 0)+len(files)
 
                 #> scan path
                 if output_quality:
@@ -502,10 +746,11 @@ def getscan(
 
                 
                 if info_only:
-                    out[s_type_id] = files
+                    out[s_type_id].extend(files)
 
                 #> download all files in every scan as requested
                 else:
+                    jobs = []
                     for i in range(len(files)):
                         
                         if output_quality:
@@ -515,19 +760,41 @@ def getscan(
                             fname = 'scan-'+s_type_id+fcomment\
                                 +'.'+files[i]['Name'].split('.',1)[-1]
 
-                        status = get_file(
+                        jobs.append((
                             xc['url']+files[i]['URI'],
                             os.path.join(spth, fname),
-                            cookie=cookie,
-                            Cnt=Cnt)
-
-                        if status<0:
-                            log.error('no scan data for {}'.format(scntype))
+                            files[i].get('digest')))
+
+                    #> parallel download with autotuned concurrency
+                    #> (continued over all scans and formats)
+                    dgsts = {}
+                    status = get_files(jobs, cookie=cookie, Cnt=Cnt, tune=tune, dgsts=dgsts)
+                    store_digests(dgsts)
+
+                    #> downloaded files of this format
+                    fout = []
+                    for job, sts in zip(jobs, status):
+                        if sts<0:
+                            log.error('no scan data for {}'.format(s_type_id))
                         else:
-                            out[s_type_id].append(os.path.join(spth, fname))
+                            fout.append(job[1])
                     
                     if len(files)<1: 
-                        log.error('no scan data for {}'.format(scntype))
+                        log.error('no scan data for {}'.format(s_type_id))
+
+                    #> pack only complete series (one container per format)
+                    elif packed and len(fout)==len(jobs):
+                        fout = [pack_series(
+                            spth,
+                            fpack=spth+'_'+e['format'].lower()+pack_ext,
+                            fnms=[os.path.basename(job[1]) for job in jobs],
+                            nthrd=Cnt.get('NTHRD'),
+                            remove=True)]
+
+                    elif packed:
+                        log.error('incomplete series {} is not packed.'.format(s_type_id))
+
+                    out[s_type_id].extend(fout)
 
     log.info('file information is contained in the output dictionary.')
     return out
@@ -545,6 +812,7 @@ def getresources(
         xc,
         outpath = '',
         cookie = '',
+        Cnt = None,
         ):
 
 
@@ -570,50 +838,62 @@ def getresources(
         opth = outpath
 
 
+    #> files to be downloaded (the others are already there)
+    fdwnld = []
+    dgsts = {}
     for i in range(len(rfiles)):
 
-        #> check if the file is already downloaded:
-        if  os.path.isfile ( os.path.join(opth, rfiles[i]['Name']) ) and \
-            str(os.path.getsize(os.path.join(opth, rfiles[i]['Name'])))==rfiles[i]['Size']:
-            
+        #> XNAT digest of the file (if reported)
+        xdgst = rfiles[i].get('digest')
+
+        #> check if the file is already downloaded (of the same size and,
+        #> if XNAT reports the digest, with the same digest: from the record
+        #> or, if there is none, computed once and recorded)
+        fpth = os.path.join(opth, rfiles[i]['Name'])
+        skip = os.path.isfile(fpth) and str(os.path.getsize(fpth))==rfiles[i]['Size']
+        if skip and xdgst:
+            fdgst = cached_digest(fpth)
+            if fdgst is None:
+                fdgst = file_digest(fpth)
+                if fdgst==xdgst:
+                    dgsts[fpth] = digest_record(fpth, fdgst)
+            skip = fdgst==xdgst
+
+        if skip:
             print('i> file of the same size,',rfiles[i]['Name'], 'already exists: skipping download.')
-            
-            if '.dcm' in rfiles[i]['Name'].lower():
-                if 'dcm' not in out: out['dcm'] = []
-                out['dcm'].append(os.path.join(opth, rfiles[i]['Name']))
-            elif '.bf' in rfiles[i]['Name'].lower():
-                if 'bf' not in out: out['bf'] = []
-                out['bf'].append(os.path.join(opth, rfiles[i]['Name']))
-            elif '.ima' in rfiles[i]['Name'].lower():
-                if 'ima' not in out: out['ima'] = []
-                out['ima'].append(os.path.join(opth, rfiles[i]['Name']))
-            elif '.nii' in rfiles[i]['Name'].lower():
-                if 'nii' not in out: out['ima'] = []
-                out['nii'].append(os.path.join(opth, rfiles[i]['Name']))
-
-        
+
         else:
-            status = get_file(
-                xc['url']+rfiles[i]['URI'], os.path.join(opth, rfiles[i]['Name']),
-                cookie = cookie
-            )
-            if status<0:
-                print('e> error downloading:', fcomment)
-            else:
-                if '.dcm' in rfiles[i]['Name'].lower():
-                    if 'dcm' not in out: out['dcm'] = []
-                    out['dcm'].append(os.path.join(opth, rfiles[i]['Name']))
-                    
-                elif '.bf' in rfiles[i]['Name'].lower():
-                    if 'bf' not in out: out['bf'] = []
-                    out['bf'].append(os.path.join(opth, rfiles[i]['Name']))
-                    
-                elif '.ima' in rfiles[i]['Name'].lower():
-                    if 'ima' not in out: out['ima'] = []
-                    out['ima'].append(os.path.join(opth, rfiles[i]['Name']))
-                elif '.nii' in rfiles[i]['Name'].lower():
-                    if 'nii' not in out: out['nii'] = []
-                    out['nii'].append(os.path.join(opth, rfiles[i]['Name']))
+            fdwnld.append(i)
+
+    #> parallel download with autotuned concurrency
+    status = get_files(
+        [(  xc['url']+rfiles[i]['URI'],
+            os.path.join(opth, rfiles[i]['Name']),
+            rfiles[i].get('digest')) for i in fdwnld],
+        cookie = cookie,
+        Cnt = Cnt,
+        dgsts = dgsts)
+    store_digests(dgsts)
+    failed = [i for i, sts in zip(fdwnld, status) if sts<0]
+
+    for i in range(len(rfiles)):
+
+        if i in failed:
+            print('e> error downloading:', rfiles[i]['Name'])
+            continue
+
+        if '.dcm' in rfiles[i]['Name'].lower():
+            if 'dcm' not in out: out['dcm'] = []
+            out['dcm'].append(os.path.join(opth, rfiles[i]['Name']))
+        elif '.bf' in rfiles[i]['Name'].lower():
+            if 'bf' not in out: out['bf'] = []
+            out['bf'].append(os.path.join(opth, rfiles[i]['Name']))
+        elif '.ima' in rfiles[i]['Name'].lower():
+            if 'ima' not in out: out['ima'] = []
+            out['ima'].append(os.path.join(opth, rfiles[i]['Name']))
+        elif '.nii' in rfiles[i]['Name'].lower():
+            if 'nii' not in out: out['nii'] = []
+            out['nii'].append(os.path.join(opth, rfiles[i]['Name']))
                 
     if len(rfiles)<1:
         print('e> requested resources data is missing.')
@@ -0,0 +1,120 @@
+""" Pushing the classification of scans to XNAT and reading it back, checked
+    against a local HTTP server.
+"""
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import pytest
+from pydicom.data import get_testdata_file
+
+pytest.importorskip('pycurl')
+from niftypet.nixnat.xnat import meta, pack  # noqa: E402
+
+INFO = {
+    '1': {'category': 'mr', 'scanner_id': 'mmr', 'TR': 2.0, 'TE': 0.1},
+    '2': {'category': 'raw/list', 'scanner_id': 'mmr', 'TR': 0, 'TE': 0}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    ''' Records the requests and stores PUT bodies by path; the resource
+        exists already (409), and paths in srv.fail get 500.
+    '''
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, body=b''):
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        srv = self.server
+        path = self.path.split('?')[0]
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        srv.requests.append(('PUT', unquote(self.path)))
+        if any(f in path for f in srv.fail):
+            self.reply(500)
+        elif path.endswith('/resources/'+meta.meta_resource):
+            self.reply(409)
+        else:
+            srv.files[path] = body
+            self.reply(200)
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path in self.server.files:
+            self.reply(200, self.server.files[path])
+        else:
+            self.reply(404, b'not found')
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    srv.requests = []
+    srv.files = {}
+    srv.fail = []
+    url = 'http://127.0.0.1:{}'.format(srv.server_port)
+    srv.xc = {'url': url, 'sbj': url+'/data/projects/P/subjects', 'cookie': 'c', 'usrpwd': 'u:p'}
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_push_sidecar(server):
+    assert meta.push_dcminfo({('S', 'E'): INFO}, server.xc, wait=True)==['E']
+    #> resource created (409 accepted), then one upload for all scans
+    assert len(server.requests)==2
+    fpth = '/data/projects/P/subjects/S/experiments/E/resources/NIXNAT/files/dcminfo.json'
+    assert json.loads(server.files[fpth])==INFO
+    assert meta.get_dcminfo('S', 'E', server.xc, category='raw')=={'2': INFO['2']}
+
+
+def test_push_fields(server):
+    meta.push_dcminfo({('S', 'E'): INFO}, server.xc, mode='fields', wait=True)
+    #> one request per scan, with custom fields only
+    assert len(server.requests)==2
+    for sid, (mthd, uri) in zip(INFO, server.requests):
+        assert uri.startswith('/data/projects/P/subjects/S/experiments/E/scans/'+sid+'?')
+        qry = dict(q.rsplit('=', 1) for q in uri.split('?', 1)[1].split('&'))
+        assert qry=={
+            meta._field_xpath(f): str(INFO[sid][k]) for f, k in meta.meta_fields.items()}
+
+
+def test_push_failure_reported(server, caplog):
+    server.fail = ['/files/']
+    with caplog.at_level(logging.ERROR):
+        futs = meta.push_dcminfo({('S', 'E'): INFO}, server.xc)
+        with pytest.raises(IOError):
+            futs[0].result()
+        #> the error is logged by the done callback, after the result is set
+        for _ in range(100):
+            if 'pushing the classification failed' in caplog.text:
+                break
+            time.sleep(0.01)
+    assert 'pushing the classification failed' in caplog.text
+
+
+def test_classify_uses_first_dicom(tmp_path):
+    spth = tmp_path/'scan'
+    spth.mkdir()
+    (spth/'a.bf').write_bytes(b'raw')
+    (spth/'b.dcm').write_bytes(open(get_testdata_file('MR_small.dcm'), 'rb').read())
+    fpack = pack.pack_series(str(spth))
+
+    nii = tmp_path/'scan.nii'
+    nii.write_bytes(b'nifti')
+    out = {
+        'cookie': 'c', 'nfiles': {'1_T1': 3, '2_T2': 1},
+        '1_T1': [str(nii), fpack], '2_T2': [str(nii)]}
+    info = meta.classify_scans(out)
+    assert list(info)==['1']
+    assert info['1']['category'].startswith('mr')
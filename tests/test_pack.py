@@ -0,0 +1,64 @@
+""" Packing of DICOM series into one container and reading it back.
+"""
+import os
+
+import pydicom as dcm
+import pytest
+from pydicom.data import get_testdata_file
+
+from niftypet.nixnat.xnat import pack
+
+RAW = os.urandom(300000)
+
+
+@pytest.fixture
+def series(tmp_path):
+    ''' Four CT slices and a raw file (sorted first) in a scan folder.
+    '''
+    spth = tmp_path/'scan'
+    spth.mkdir()
+    ds = dcm.dcmread(get_testdata_file('CT_small.dcm'))
+    for i in range(4):
+        ds.InstanceNumber = i+1
+        ds.SOPInstanceUID = ds.SOPInstanceUID.rsplit('.', 1)[0]+'.'+str(i+1)
+        ds.save_as(str(spth/'slice{}.dcm'.format(i)))
+    (spth/'a.bf').write_bytes(RAW)
+    return spth
+
+
+def test_round_trip(series, tmp_path, monkeypatch):
+    #> raw data streamed in several chunks
+    monkeypatch.setattr(pack, 'chunk_size', 65536)
+    orig = {f: (series/f).read_bytes() for f in os.listdir(series)}
+
+    fpack = pack.pack_series(str(series), nthrd=2, remove=True)
+    assert fpack==str(series)+pack.pack_ext
+    assert pack.is_packed(fpack)
+    assert not series.exists()
+
+    index = pack.packed_files(fpack)
+    assert [f['name'] for f in index]==sorted(orig)
+    assert [f['kind'] for f in index]==['raw']+['dcm']*4
+    assert pack.first_dicom(fpack)==1
+
+    assert pack.read_packed(fpack, 'a.bf')==RAW
+    ds = pack.read_packed(fpack, 'slice2.dcm')
+    assert ds==dcm.dcmread(dcm.filebase.DicomBytesIO(orig['slice2.dcm']))
+    assert ds.InstanceNumber==3
+
+    fout = pack.unpack_series(fpack, str(tmp_path/'out'))
+    assert sorted(os.path.basename(f) for f in fout)==sorted(orig)
+    assert (tmp_path/'out'/'a.bf').read_bytes()==RAW
+    for i in range(4):
+        fnm = 'slice{}.dcm'.format(i)
+        assert dcm.dcmread(str(tmp_path/'out'/fnm))==dcm.dcmread(
+            dcm.filebase.DicomBytesIO(orig[fnm]))
+
+
+def test_round_trip_without_dedup(series, tmp_path):
+    orig = {f: (series/f).read_bytes() for f in os.listdir(series)}
+    fpack = pack.pack_series(str(series), fpack=str(tmp_path/'s.nxz'), dedup=False)
+    #> without the shared header the original bytes are kept
+    assert series.exists()
+    for f in orig:
+        assert pack.read_packed(fpack, f, raw=True)==orig[f]
@@ -0,0 +1,82 @@
+""" Sharing the download of scans between workers through the SQLite work
+    queue, with `getscan` replaced by a local stand-in.
+"""
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from niftypet.nixnat.xnat import shard, xnat
+
+
+def fake_getscan(sbjix, expt, xc, scan_ids=(), outpath='', Cnt=None, **kwargs):
+    ''' Writes one file per scan, with the worker's process ID in it.
+    '''
+    time.sleep(0.02)
+    out = {'cookie': 'c', 'nfiles': {}}
+    for sid in scan_ids:
+        key = sid+'_T'
+        spth = os.path.join(outpath, key)
+        os.makedirs(spth, exist_ok=True)
+        fpth = os.path.join(spth, 'scan-'+sid+'.dcm')
+        with open(fpth, 'w') as f:
+            f.write(str(os.getpid()))
+        out['nfiles'][key] = 1
+        out[key] = [fpth]
+    return out
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(xnat, 'getscan', fake_getscan)
+    fdb = str(tmp_path/'queue.db')
+    items = [
+        {'sbjix': 's', 'expt': 'E{}'.format(i%3), 'scan': str(i)} for i in range(12)]
+    shard.init_queue(fdb, items)
+    return fdb, items
+
+
+def check_layout(outpath, items):
+    for itm in items:
+        sdir = os.path.join(outpath, itm['expt'], itm['scan']+'_T')
+        assert os.listdir(sdir)==['scan-'+itm['scan']+'.dcm']
+    assert sorted(os.listdir(outpath))==['E0', 'E1', 'E2', 'queue.db']
+
+
+@pytest.mark.skipif(
+    multiprocessing.get_start_method()!='fork',
+    reason='the stand-in for getscan is passed on by forking')
+def test_run_workers(queue, tmp_path):
+    fdb, items = queue
+    status = shard.run_workers(fdb, {'cookie': 'c'}, 3, outpath=str(tmp_path))
+    assert status=={shard.DONE: len(items)}
+    check_layout(str(tmp_path), items)
+
+
+def test_lease_takeover(queue, tmp_path):
+    fdb, items = queue
+    #> a crashed worker: expired lease and a partial folder left behind
+    key, itm, token = shard.claim_work(fdb, 'crashed', lease=-1)
+    os.makedirs(os.path.join(str(tmp_path), shard.part_dir, token, 'x'))
+
+    done = shard.work_queue(fdb, {'cookie': 'c'}, outpath=str(tmp_path), worker='w')
+    assert sorted(done)==sorted('/'.join(['s', i['expt'], i['scan']]) for i in items)
+    assert shard.held_tokens(fdb)==set()
+    assert shard.queue_status(fdb)=={shard.DONE: len(items)}
+    check_layout(str(tmp_path), items)
+
+    #> the crashed worker coming back cannot complete the item
+    called = []
+    assert not shard.complete_work(fdb, key, token, commit_files=lambda: called.append(1))
+    assert called==[]
+
+
+def test_complete_with_wrong_token(queue):
+    fdb, items = queue
+    key, itm, token = shard.claim_work(fdb, 'w')
+    called = []
+    assert not shard.complete_work(fdb, key, 'other', commit_files=lambda: called.append(1))
+    assert called==[]
+    assert shard.complete_work(fdb, key, token, commit_files=lambda: called.append(1))
+    assert called==[1]
@@ -0,0 +1,133 @@
+""" Concurrency tuning of parallel downloads, checked against a local HTTP
+    server with shaped bandwidth.
+"""
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('pycurl')
+from niftypet.nixnat.xnat import tune  # noqa: E402
+
+#> bandwidth per connection and in total [B/s]
+PER_CONN = 1e6
+TOTAL = 4e6
+BODY = os.urandom(200000)
+CHUNK = 10000
+
+
+class ShapedHandler(BaseHTTPRequestHandler):
+    ''' Serves BODY at min(PER_CONN, TOTAL/active connections); paths with
+        'busy' are refused once with 503 and Retry-After, paths with 'drop'
+        have the connection closed once without a response.
+    '''
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        srv = self.server
+        with srv.lock:
+            srv.requests.append((self.path, time.time()))
+            first = srv.seen.get(self.path, 0)==0
+            srv.seen[self.path] = srv.seen.get(self.path, 0)+1
+        if first and 'busy' in self.path:
+            self.send_response(503)
+            self.send_header('Retry-After', '0.3')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if first and 'drop' in self.path:
+            self.close_connection = True
+            return
+
+        with srv.lock:
+            srv.active += 1
+        try:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            for k in range(0, len(BODY), CHUNK):
+                self.wfile.write(BODY[k:k+CHUNK])
+                time.sleep(CHUNK/min(PER_CONN, TOTAL/max(srv.active, 1)))
+        finally:
+            with srv.lock:
+                srv.active -= 1
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), ShapedHandler)
+    srv.lock = threading.Lock()
+    srv.active = 0
+    srv.seen = {}
+    srv.requests = []
+    thrd = threading.Thread(target=srv.serve_forever, daemon=True)
+    thrd.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def jobs_for(srv, tmp_path, prefix, n):
+    url = 'http://127.0.0.1:{}'.format(srv.server_port)
+    md5 = hashlib.md5(BODY).hexdigest()
+    return [(url+'/'+prefix+str(i), str(tmp_path/'{}{}.bin'.format(prefix, i)), md5)
+            for i in range(n)]
+
+
+def test_settles_at_bandwidth_limit():
+    #> windows of <conc> transfers sharing the bandwidth of the server
+    state = tune.aimd_init(cmax=10)
+    concs = []
+    for _ in range(40):
+        conc = state['conc']
+        rate = min(PER_CONN, TOTAL/conc)
+        size = len(BODY)
+        tune.aimd_step(state, conc*size, size/rate, 0, ttime=conc*size/rate, ttfb=0.01)
+        concs.append(state['conc'])
+    #> TOTAL/PER_CONN parallel transfers saturate the server; probing one more
+    assert concs[:4]==[2, 3, 4, 5]
+    assert set(concs[4:])=={4, 5}
+    assert concs[4:].count(4)>3*concs[4:].count(5)
+
+
+def test_parallel_download(server, tmp_path):
+    state = {}
+    jobs = jobs_for(server, tmp_path, 'f', 24)
+    status = tune.get_files(jobs, usrpwd='u:p', Cnt={'NCONC_MAX': 10}, tune=state)
+    assert status==[0]*len(jobs)
+    for uri, fname, md5 in jobs:
+        assert open(fname, 'rb').read()==BODY
+    assert max(h[0] for h in state['history'])>1
+
+    #> a following call continues from the concurrency reached
+    conc = state['conc']
+    tune.get_files(jobs_for(server, tmp_path, 'g', 1), usrpwd='u:p', Cnt={'AUTOTUNE': False},
+                   tune=state)
+    assert state['conc']==conc
+
+
+def test_busy_server_retry_after(server, tmp_path):
+    status = tune.get_files(jobs_for(server, tmp_path, 'busy', 4), usrpwd='u:p')
+    assert all(s==0 for s in status)
+    for i in range(4):
+        times = [t for p, t in server.requests if p=='/busy'+str(i)]
+        assert len(times)==2
+        assert times[1]-times[0]>=0.3
+
+
+def test_connection_error_retried(server, tmp_path):
+    status = tune.get_files(jobs_for(server, tmp_path, 'drop', 2), usrpwd='u:p')
+    assert all(s==0 for s in status)
+
+
+def test_backoff_on_growing_ttfb():
+    state = tune.aimd_init(conc=4)
+    tune.aimd_step(state, 4e6, 1., 0, ttime=4., ttfb=0.01)
+    conc = state['conc']
+    assert tune.aimd_step(state, 4e6, 1., 0, ttime=4., ttfb=0.5)==conc-1
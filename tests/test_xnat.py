@@ -0,0 +1,157 @@
+""" Digest verification of downloads and uploads, checked against a local
+    HTTP server.
+"""
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('pycurl')
+from niftypet.nixnat.xnat import xnat  # noqa: E402
+
+BODY = os.urandom(50000)
+MD5 = hashlib.md5(BODY).hexdigest()
+
+
+class Handler(BaseHTTPRequestHandler):
+    ''' GET /good: BODY; /flaky: corrupted BODY the first time; /drop: the
+        connection closed without a response; /res/files: JSON listing of the
+        uploaded files with their MD5.
+        PUT /res/files/<name>: stores the body (corrupted the first time if
+        srv.corrupt_upload), 409 if the file exists and no overwrite=true.
+    '''
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, code, body=b''):
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        srv = self.server
+        path = self.path.split('?')[0]
+        srv.requests.append(self.path)
+        if path=='/drop':
+            self.close_connection = True
+            return
+        if path=='/res/files':
+            res = [{'Name': k, 'digest': hashlib.md5(v).hexdigest()}
+                   for k, v in srv.uploads.items()]
+            self.reply(200, json.dumps({'ResultSet': {'Result': res}}).encode())
+            return
+        n = sum(1 for r in srv.requests if r.split('?')[0]==path)
+        if path=='/flaky' and n==1:
+            self.reply(200, BODY[::-1])
+            return
+        self.reply(200, BODY)
+
+    def do_PUT(self):
+        srv = self.server
+        srv.requests.append(self.path)
+        path, qry = (self.path.split('?')+[''])[:2]
+        name = path.rsplit('/', 1)[1]
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if name in srv.uploads and 'overwrite=true' not in qry:
+            self.reply(409)
+            return
+        if srv.corrupt_upload and name not in srv.uploads:
+            data = data[::-1]
+        srv.uploads[name] = data
+        self.reply(200)
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    srv.requests = []
+    srv.uploads = {}
+    srv.corrupt_upload = False
+    srv.url = 'http://127.0.0.1:{}'.format(srv.server_port)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_get_file_retries_on_digest_mismatch(server, tmp_path):
+    fout = str(tmp_path/'a.bin')
+    assert xnat.get_file(server.url+'/flaky', fout, usrpwd='u:p', digest=MD5)==0
+    assert server.requests==['/flaky', '/flaky']
+    assert open(fout, 'rb').read()==BODY
+    assert xnat.cached_digest(fout)==MD5
+
+
+def test_get_file_gives_up_and_removes_file(server, tmp_path):
+    fout = str(tmp_path/'a.bin')
+    assert xnat.get_file(
+        server.url+'/good', fout, usrpwd='u:p', digest='0'*32, Cnt={'RETRY': 1})==-1
+    assert len(server.requests)==2
+    assert not os.path.exists(fout)
+
+
+def test_get_file_removes_truncated_file(server, tmp_path):
+    fout = str(tmp_path/'a.bin')
+    stats = {}
+    assert xnat.get_file(server.url+'/drop', fout, usrpwd='u:p', stats=stats)==-1
+    assert 'error' in stats
+    assert not os.path.exists(fout)
+
+
+def test_getresources_verifies_existing_files(server, tmp_path):
+    rfiles = [
+        {'Name': n, 'URI': '/good', 'Size': str(len(BODY)), 'digest': MD5}
+        for n in ['a.bf', 'b.bf']]
+    #> correct file without a record: hashed once and recorded, not downloaded
+    (tmp_path/'a.bf').write_bytes(BODY)
+    #> same size, different content: downloaded
+    (tmp_path/'b.bf').write_bytes(BODY[::-1])
+
+    out = xnat.getresources(rfiles, {'url': server.url}, outpath=str(tmp_path), cookie='c')
+    assert server.requests==['/good']
+    assert (tmp_path/'b.bf').read_bytes()==BODY
+    assert sorted(out['bf'])==[str(tmp_path/'a.bf'), str(tmp_path/'b.bf')]
+    assert xnat.cached_digest(str(tmp_path/'a.bf'))==MD5
+    assert xnat.cached_digest(str(tmp_path/'b.bf'))==MD5
+
+
+def test_put_file_overwrites_on_retry(server, tmp_path):
+    fin = tmp_path/'up.bin'
+    fin.write_bytes(BODY)
+    server.corrupt_upload = True
+    assert xnat.put_file(server.url+'/res/files', str(fin), usrpwd='u:p', verify=True)==MD5
+    puts = [r for r in server.requests if r.startswith('/res/files/')]
+    assert len(puts)==2
+    assert 'overwrite=true' not in puts[0] and 'overwrite=true' in puts[1]
+    assert server.uploads['up.bin']==BODY
+
+
+def test_put_file_verify_needs_md5(tmp_path):
+    fin = tmp_path/'up.bin'
+    fin.write_bytes(BODY)
+    with pytest.raises(ValueError):
+        xnat.put_file('http://127.0.0.1:1/res/files', str(fin), usrpwd='u:p',
+                      verify=True, hashtype='sha256')
+
+
+def test_dcminfo_packed_uses_first_dicom(tmp_path):
+    from pydicom.data import get_testdata_file
+    from niftypet.nixnat.xnat import pack
+
+    spth = tmp_path/'scan'
+    spth.mkdir()
+    (spth/'a.nii').write_bytes(BODY)
+    (spth/'b.dcm').write_bytes(open(get_testdata_file('MR_small.dcm'), 'rb').read())
+    fpack = pack.pack_series(str(spth))
+    assert xnat.dcminfo(fpack)==xnat.dcminfo(str(spth/'b.dcm'))
+
+
+def test_dcminfo_rejects_other_input():
+    with pytest.raises(TypeError):
+        xnat.dcminfo(1)